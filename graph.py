@@ -5,7 +5,14 @@
     A very simple unweighted Graph datatype. Each node consists entirely
     of a string (the node's name), and is stored as a key in a dictionary
     (self.adjacencies). The value associated with a node in this dictionary
-    is a set of the names of the node's neighbors.
+    is another dictionary whose keys are the names of the node's neighbors
+    (its values are unused). Unlike a set, this remembers the order in which
+    the edges were added, so traversals and exports come out the same way
+    every time.
+
+    For its traversals, a Graph numbers its nodes and packs self.adjacencies
+    into integer arrays in CSR form (see _build_csr below). That copy is
+    built on first use and then kept in self._csr until the graph changes.
 
     Currently, this class supports:
 
@@ -29,9 +36,83 @@
     be ->'s, and the word "graph" would be replaced by "digraph". DOT has *many*
     more features, but that's all this Graph class supports.
 '''
-from queue import Queue
+from array import array
+from itertools import accumulate, chain
 import re
-import copy
+import sys
+
+# The header line that opens a dotfile (groups: 'di' if directed, graph name)
+_RE_HEADER = re.compile(r'\s*(di)?graph\s+(\S+)\s*\{')
+# One edge line of a dotfile (groups: source node, arrow, destination node)
+_RE_EDGE = re.compile(r'^[ \t]*(\S+)[ \t]*(--|->)[ \t]*(\S+)[ \t]*;', re.M)
+
+# The most traversal results a Graph remembers at once
+_CACHE_SIZE = 128
+
+# Stands in for the neighbors of a node that isn't in the graph
+_EMPTY = frozenset()
+
+# The traversal kernels below work on a graph in compressed sparse row (CSR)
+# form: the neighbors of node i are indices[indptr[i]:indptr[i+1]]. They
+# only touch flat integer arrays, never names or dicts.
+
+def _build_csr(adjacencies):
+    ''' Numbers the nodes of adjacencies in order and packs its edges into
+        CSR form. Returns (names, ids, indptr, indices), where names[i] is
+        the name of node i and ids maps each name back to its number. '''
+    names = list(adjacencies)
+    ids = dict(zip(names, range(len(names))))
+    indptr = array('i', [0])
+    indptr.extend(accumulate(map(len, adjacencies.values())))
+    indices = array('i', [ids[neighbor]
+                          for neighbor in chain.from_iterable(adjacencies.values())])
+    return names, ids, indptr, indices
+
+def _bfs_csr(indptr, indices, start):
+    ''' Breadth-first search from start. Returns the nodes reached, in the
+        order they were visited, and each node's parent in the search
+        (start is its own parent; unreached nodes have parent -1). '''
+    n = len(indptr) - 1
+    parent = array('i', [-1]) * n
+    parent[start] = start
+    order = array('i', [0]) * n
+    order[0] = start
+    head, tail = 0, 1
+    while head < tail:
+        u = order[head]
+        head += 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if parent[v] == -1:
+                parent[v] = u
+                order[tail] = v
+                tail += 1
+    return order[:tail], parent
+
+def _topological_sort_csr(indptr, indices):
+    ''' Kahn's algorithm. Returns the nodes in topological order; if there
+        is a cycle, the nodes on it or reachable from it are left out. '''
+    n = len(indptr) - 1
+    indegree = array('i', [0]) * n
+    for v in indices:
+        indegree[v] += 1
+    order = array('i', [0]) * n
+    tail = 0
+    for u in range(n):
+        if indegree[u] == 0:
+            order[tail] = u
+            tail += 1
+    head = 0
+    while head < tail:
+        u = order[head]
+        head += 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                order[tail] = v
+                tail += 1
+    return order[:tail]
 
 class Graph:
     def __init__(self, dotfile=None, directed=False, name='G'):
@@ -41,7 +122,9 @@ class Graph:
         self.directed = directed
         self.name = name
         self.adjacencies = {}
-        self.notVisited = []
+        self._csr = None
+        self._sorted_nodes = None
+        self._traversals = {}
         if dotfile is not None:
             self._load_from_dotfile(dotfile)
 
@@ -50,59 +133,75 @@ class Graph:
             that this object has been initialized to empty before this method
             is called. '''
         with open(dotfile) as f:
-            for line in f:
-                if 'digraph' in line:
-                    match = re.search(r'^\s*digraph\s+(\S+)\s*{', line)
-                    if match:
-                        self.name = match.group(1)
-                        self.directed = True
-                elif 'graph' in line:
-                    match = re.search(r'^\s*graph\s+(\S+)\s*{', line)
-                    if match:
-                        self.name = match.group(1)
-                        self.directed = False
-                elif ('--' in line and not self.directed) or ('->' in line and self.directed):
-                    match = re.search(r'^\s*(\S+)\s*-[->]\s*(\S+)\s*;', line)
-                    if match:
-                        u = match.group(1)
-                        v = match.group(2)
-                        self.add_node(u)
-                        self.add_node(v)
-                        self.add_edge(u, v)
+            data = f.read()
+
+        #the header has to come first, so only the start of the file is
+        #checked for it; edges are then only looked for after it
+        match = _RE_HEADER.match(data)
+        start = 0
+        if match:
+            self.name = match.group(2)
+            self.directed = match.group(1) is not None
+            start = match.end()
+        arrow = '->' if self.directed else '--'
+
+        #hoisted out of the loop; most edges mention nodes that were
+        #already added, so add_node is only called for new ones
+        adjacencies = self.adjacencies
+        add_node = self.add_node
+        add_edge = self._add_edge_unchecked
+        for match in _RE_EDGE.finditer(data, start):
+            if match.group(2) != arrow:
+                continue
+            #interned so every mention of a node shares one string
+            u = sys.intern(match.group(1))
+            v = sys.intern(match.group(3))
+            if u not in adjacencies:
+                add_node(u)
+            if v not in adjacencies:
+                add_node(v)
+            add_edge(u, v)
 
     def __str__(self):
-        s = f'[Graph {self.name}, directed: {self.directed}]\n'
-        for node in sorted(self.adjacencies):
-            s += f'{node}: ' + ', '.join(sorted(self.adjacencies[node])) + '\n'
-        return s
+        parts = [f'[Graph {self.name}, directed: {self.directed}]\n']
+        for node in self._nodes_sorted():
+            parts.append(f'{node}: ' + ', '.join(sorted(self.adjacencies[node])) + '\n')
+        return ''.join(parts)
 
     def to_dot(self):
         if self.directed:
-            dot = 'digraph'
+            kind = 'digraph'
             arrow = '->' 
         else:
-            dot = 'graph'
+            kind = 'graph'
             arrow = '--' 
-        dot += f' {self.name} {{\n'
-
-        for node in sorted(self.adjacencies):
-            if len(self.adjacencies[node]) == 0:
-                dot += f'  {node};\n'
+        parts = [f'{kind} {self.name} {{\n']
+
+        #neighbors are emitted in the order their edges were added;
+        #undirected edges are only written from the endpoint that sorts first
+        for node in self._nodes_sorted():
+            neighbors = self.adjacencies[node]
+            if len(neighbors) == 0:
+                parts.append(f'  {node};\n')
+            elif self.directed:
+                parts.extend(f'  {node} {arrow} {neighbor};\n' for neighbor in neighbors)
             else:
-                for neighbor in self.adjacencies[node]:
-                    if self.directed or node < neighbor:
-                        dot += f'  {node} {arrow} {neighbor};\n'
+                parts.extend(f'  {node} {arrow} {neighbor};\n' for neighbor in neighbors
+                             if node < neighbor)
 
-        dot += '}\n'
-        return dot
+        parts.append('}\n')
+        return ''.join(parts)
 
     def has_edge(self, u, v):
-        return u in self.adjacencies and v in self.adjacencies[u]
+        return v in self.adjacencies.get(u, _EMPTY)
 
     def add_node(self, node):
-        if node not in self.adjacencies:
-            self.adjacencies[node] = set()
-            self.notVisited.append(node)
+        adjacencies = self.adjacencies
+        if node not in adjacencies:
+            adjacencies[node] = {}
+            self._csr = None
+            self._traversals.clear()
+            self._sorted_nodes = None
 
     def add_nodes(self, nodes):
         for node in nodes:
@@ -110,19 +209,114 @@ class Graph:
 
     def add_edge(self, u, v):
         if u in self.adjacencies and v in self.adjacencies:
-            self.adjacencies[u].add(v)
-            if not self.directed:
-                self.adjacencies[v].add(u)
+            self._add_edge_unchecked(u, v)
         else:
             print(f'Trying to add edge ({u},{v}) between unrecognized nodes')
 
+    def _add_edge_unchecked(self, u, v):
+        ''' Adds the edge (u,v), assuming the caller has already made sure
+            that both u and v are nodes of this Graph. '''
+        neighbors = self.adjacencies[u]
+        if v in neighbors:
+            return
+        neighbors[v] = None
+        if not self.directed:
+            self.adjacencies[v][u] = None
+        self._csr = None
+        self._traversals.clear()
+
     def add_edges(self, edges):
         for u, v in edges:
             self.add_edge(u, v)
 
     def remove_node(self, node):
+        ''' Removes node and every edge into or out of it. '''
         if node in self.adjacencies: 
-            self.adjacencies.pop(node)
+            neighbors = self.adjacencies.pop(node)
+            if self.directed:
+                #an edge into node can come from any other node
+                for others in self.adjacencies.values():
+                    others.pop(node, None)
+            else:
+                #every edge at node is stored at both of its ends
+                for neighbor in neighbors:
+                    if neighbor != node:
+                        self.adjacencies[neighbor].pop(node, None)
+            self._csr = None
+            self._sorted_nodes = None
+            self._traversals.clear()
+
+    def _nodes_sorted(self):
+        ''' Returns the names of this Graph's nodes in sorted order, sorting
+            them only if the node set has changed since the last call. '''
+        if self._sorted_nodes is None:
+            self._sorted_nodes = sorted(self.adjacencies)
+        return self._sorted_nodes
+
+    def _get_csr(self):
+        ''' Returns this Graph's (names, ids, indptr, indices), as built by
+            _build_csr, rebuilding them if the graph has changed since they
+            were last built. '''
+        if self._csr is None:
+            self._csr = _build_csr(self.adjacencies)
+        return self._csr
+
+    def _cached(self, key, compute, *args):
+        ''' Returns compute(*args), remembering the result under key until
+            this Graph next changes. At most _CACHE_SIZE results are kept;
+            the least recently used one is dropped to make room. '''
+        cache = self._traversals
+        if key in cache:
+            result = cache.pop(key)
+        else:
+            result = compute(*args)
+            if len(cache) >= _CACHE_SIZE:
+                del cache[next(iter(cache))]
+        cache[key] = result
+        return result
+
+    def _copy(self):
+        ''' Returns a copy of this Graph that shares none of its neighbor
+            dicts, so either one can be changed without affecting the other. '''
+        graph = Graph(directed=self.directed, name=self.name)
+        graph.adjacencies = {node: neighbors.copy()
+                             for node, neighbors in self.adjacencies.items()}
+        return graph
+
+    @classmethod
+    def _from_parents(cls, parents, name):
+        ''' Returns an undirected Graph with the nodes of parents (a dict
+            like the one bfs_parents returns) and an edge between each node
+            and its parent. '''
+        adjacencies = {node: {} for node in parents}
+        for node, parent in parents.items():
+            if parent is not None:
+                adjacencies[parent][node] = None
+                adjacencies[node][parent] = None
+        tree = cls(name=name)
+        tree.adjacencies = adjacencies
+        return tree
+
+    def bfs_parents(self, start_node):
+        ''' Returns a dict mapping each node reached by a breadth-first
+            search starting at start_node to the node it was discovered
+            from (None for start_node), in the order they were reached.
+
+            Returns an empty dict if this Graph is directed or if
+            start_node is not in this Graph. '''
+        if self.directed == True or start_node not in self.adjacencies:
+            return {}
+        return dict(self._cached(('bfs', start_node), self._bfs_parents, start_node))
+
+    def _bfs_parents(self, start_node):
+        ''' Does the work of bfs_parents, uncached; start_node must be a
+            node of this Graph. '''
+        names, ids, indptr, indices = self._get_csr()
+        order, parent = _bfs_csr(indptr, indices, ids[start_node])
+        parents = {start_node: None}
+        for node in order[1:]:
+            parents[names[node]] = names[parent[node]]
+        return parents
 
     def bfs_tree(self, start_node):
         ''' Returns a Graph with the same node set as this Graph instance,
@@ -133,29 +327,14 @@ class Graph:
             start_node is not in this Graph. '''
 
         #checks if graph is directed or if start_node is not in graph 
-        #O(V) worst case 
         if self.directed == True or start_node not in self.adjacencies:
             return Graph(name='EmptyBFSTree')
 
-        BFSTree = Graph(name='BFSTree')
-        queue = Queue()
-        queue.put(start_node)
-        BFSTree.add_node(start_node)
-        unvisited = copy.copy(self.notVisited)
-
-        #while there are unvisited nodes, adds them and their unvisited
-        #neighbors to the queue/tree, then removes them from unvisited
-        while len(unvisited) > 0:
-            node = queue.get()
-            if node in unvisited: 
-                unvisited.remove(node)
-            for neighbor in self.adjacencies[node]: 
-                if neighbor in unvisited: 
-                    BFSTree.add_node(neighbor)
-                    BFSTree.add_edge(node,neighbor)
-                    queue.put(neighbor)
-                    unvisited.remove(neighbor)
-        return BFSTree
+        return self._cached(('bfs_tree', start_node), self._bfs_tree, start_node)._copy()
+
+    def _bfs_tree(self, start_node):
+        ''' Does the work of bfs_tree, uncached. '''
+        return Graph._from_parents(self._bfs_parents(start_node), name='BFSTree')
 
     def dfs_tree(self, start_node):
         ''' Returns a Graph with the same node set as this Graph instance,
@@ -169,86 +348,51 @@ class Graph:
         if self.directed == True or start_node not in self.adjacencies:
             return Graph(name='EmptyDFSTree')
 
-        unvisited = list(self.notVisited)
-        parent = {}
-        for node in self.adjacencies:
-            parent[node] = ''           
-        DFSTree = Graph(name='DFSTree')
-
-        #call helper method 
-        DFSTree = self.dfs_tree_helper(DFSTree,start_node,unvisited,parent)
-        return DFSTree
-    
-    def dfs_tree_helper(self,dfstree, start_node,unvisited,parent):
-        ''' Helps the DFS_tree method to recursively create a DFS tree.'''
-        
-        #adds a start_node to tree if not already there
-        if start_node in unvisited: 
-            unvisited.remove(start_node)
-            dfstree.add_node(start_node)
-            if parent[start_node] != '':
-                dfstree.add_edge(start_node,parent[start_node])
-        
-        #recursively calls itself on any unvisited neighbors
-        for neighbor in self.adjacencies[start_node]:
-            if neighbor in unvisited: 
-                parent[neighbor] = start_node
-                self.dfs_tree_helper(dfstree,neighbor,unvisited,parent)
-
-        return dfstree
+        return self._cached(('dfs_tree', start_node), self._dfs_tree, start_node)._copy()
+
+    def _dfs_tree(self, start_node):
+        ''' Does the work of dfs_tree, uncached. '''
+        return Graph._from_parents(self._dfs_parents(start_node), name='DFSTree')
+
+    def _dfs_parents(self, start_node):
+        ''' Like _bfs_parents, but for a depth-first search. dfs_tree
+            builds its tree from the result. '''
+        names, ids, indptr, indices = self._get_csr()
+        parents = {}
+        visited = [False] * len(names)
+        stack = [(ids[start_node], None)]
+
+        #pops the most recently discovered node and records the node that
+        #discovered it, then pushes its unvisited neighbors. A node may be
+        #pushed more than once before it is visited; the stale entries are
+        #skipped when popped.
+        while stack:
+            node, parent = stack.pop()
+            if visited[node]:
+                continue
+            visited[node] = True
+            parents[names[node]] = None if parent is None else names[parent]
+            for neighbor in indices[indptr[node]:indptr[node + 1]]:
+                if not visited[neighbor]:
+                    stack.append((neighbor, node))
+        return parents
 
     def topological_sort(self):
         ''' Returns a topologically sorted list of the nodes of this Graph.
             
             Returns an empty list if this Graph is not a DAG.
         '''
-        graph = copy.copy(self)
-
-        #checks if graph is a DAG using principal that every DAG will
-        #have at least one leaf, returns empty list if no leaf found
-        acyclic = False
-        for node in self.adjacencies:
-            if self.adjacencies[node] == set():
-                acyclic = True   
-        if acyclic == False: 
-            return []
-
-        noIncomingEdges = []
-        for node in graph.adjacencies:
-            noIncomingEdges.append(node)
-        topSort = []
-
-        #call the helper function
-        topSort = self.top_sort_helper(graph,noIncomingEdges,topSort)
-
-        return topSort
+        return list(self._cached(('topological_sort',), self._topological_order))
 
-    def top_sort_helper(self,graph,noIncomingEdges,topSort):
-        ''' Helps the topological_sort method to recursively sort the graph.'''
-        
-        for node in graph.adjacencies:
-            if node not in noIncomingEdges:
-                noIncomingEdges.append(node)
+    def _topological_order(self):
+        ''' Does the work of topological_sort, uncached. '''
+        names, ids, indptr, indices = self._get_csr()
+        order = _topological_sort_csr(indptr, indices)
 
-        #removes nodes with incoming edges from noIncomingEdges 
-        for node in graph.adjacencies:
-            for neighbor in graph.adjacencies[node]:
-                if neighbor in noIncomingEdges: 
-                    noIncomingEdges.remove(neighbor)
-        
-        #adds the first node in noIncomingEdges to topSort 
-        node = noIncomingEdges[0] 
-        topSort.append(node)
-
-        #removes that node from the graph, thus removing its edges as well
-        graph.remove_node(node)
-        noIncomingEdges.remove(node)
-
-        #while there are nodes left in the graph, recursively calls itself
-        while graph.adjacencies: 
-            topSort = self.top_sort_helper(graph,noIncomingEdges,topSort)
-
-        return topSort
+        #any node left out of order is on a cycle, so this isn't a DAG
+        if len(order) != len(names):
+            return []
+        return [names[node] for node in order]
 
 # Very simple-minded testing of Graph operations
 def test_report(message, g):
@@ -272,6 +416,7 @@ def test_traversals(dotfile, start_node):
     g = Graph(dotfile=dotfile)
     test_report(f'Graph loaded from {dotfile}', g)
     test_report(f'BFS tree from {start_node} for {g.name}', g.bfs_tree(start_node))
+    print(f'BFS parents from {start_node}: {g.bfs_parents(start_node)}')
     test_report(f'DFS tree from {start_node} for {g.name}', g.dfs_tree(start_node))
 
 def test_topological_sort(dotfile):